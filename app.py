@@ -2,119 +2,40 @@ import streamlit as st
 import pandas as pd
 import plotly.graph_objects as go
 import plotly.express as px
+import plotly.io as pio
+import re
+import hashlib
+import importlib.util
 import json
-import time
-import requests
 import numpy as np
-from databricks import sql
+from fraud_backend import RunFailed, clear_results, prewarm_cluster, run_notebook
 
-# Cache configuration values
-@st.cache_data
-def get_config():
-    return {
-        "DATABRICKS_HOST": st.secrets["databricks_host"],
-        "DATABRICKS_PATH": st.secrets["databricks_http_path"],
-        "DATABRICKS_TOKEN": st.secrets["databricks_token"],
-        "DATABRICKS_NOTEBOOK_PATH": st.secrets["databricks_notebook_path"],
-        "EXISTING_CLUSTER_ID": "0521-131856-gsh3b6se"
-    }
+# Serialise Plotly figures with orjson when it is installed
+if importlib.util.find_spec("orjson") is not None:
+    pio.json.config.default_engine = "orjson"
 
-# Connect to Databricks - cached connection
-@st.cache_resource
-def get_connection():
-    config = get_config()
-    try:
-        conn = sql.connect(
-            server_hostname=config["DATABRICKS_HOST"],
-            http_path=config["DATABRICKS_PATH"],
-            access_token=config["DATABRICKS_TOKEN"]
-        )
-        return conn
-    except Exception as e:
-        st.error(f"❌ Databricks connection failed: {e}")
-        return None
+# Accepted phone number format: optional leading +, then 7 to 15 digits
+PHONE_PATTERN = re.compile(r"\+?\d{7,15}")
 
-# Optimized function to run notebook with caching for repeated checks
-@st.cache_data(ttl=300)  # Cache results for 5 minutes
-def run_notebook(phone_number):
-    config = get_config()
-    headers = {
-        "Authorization": f"Bearer {config['DATABRICKS_TOKEN']}",
-        "Content-Type": "application/json"
-    }
+# Number of features shown in the individual feature importance chart
+MAX_IMPORTANCE_BARS = 20
 
-    # Submit job with optimized parameters
-    submit_payload = {
-        "run_name": f"FraudCheck_{phone_number}",
-        "notebook_task": {
-            "notebook_path": config["DATABRICKS_NOTEBOOK_PATH"],
-            "base_parameters": {
-                "phone_number": phone_number
-            }
-        },
-        "existing_cluster_id": config["EXISTING_CLUSTER_ID"]
-    }
+# Upper bound on points sent per scatter trace in the feature impact chart
+MAX_SCATTER_POINTS = 2000
 
-    response = requests.post(
-        f"{config['DATABRICKS_HOST']}/api/2.1/jobs/runs/submit",
-        headers=headers,
-        json=submit_payload
-    )
-
-    if response.status_code != 200:
-        return "FAILED", {"error": response.text}
-        
-    run_id = response.json()["run_id"]
-    
-    # Status placeholder
-    status_placeholder = st.empty()
-    
-    # More efficient polling with increasing backoff
-    backoff = 1
-    max_backoff = 5
-    while True:
-        status_response = requests.get(
-            f"{config['DATABRICKS_HOST']}/api/2.1/jobs/runs/get?run_id={run_id}",
-            headers=headers
-        )
-        
-        run_state = status_response.json()["state"]["life_cycle_state"]
-        
-        if run_state in ("TERMINATED", "SKIPPED", "INTERNAL_ERROR"):
-            break
-            
-        # Exponential backoff with cap
-        time.sleep(min(backoff, max_backoff))
-        backoff *= 1.5
-    
-    status_placeholder.empty()
-
-    result = status_response.json()
-    notebook_output_state = result.get("state", {})
-    result_state = notebook_output_state.get("result_state", "UNKNOWN")
-    
-    # Get notebook output
-    notebook_output = None
-    if result_state == "SUCCESS":
-        output_response = requests.get(
-            f"{config['DATABRICKS_HOST']}/api/2.1/jobs/runs/get-output?run_id={run_id}",
-            headers=headers
-        )
-        
-        if output_response.status_code == 200:
-            notebook_result = output_response.json().get("notebook_output", {})
-            notebook_output = notebook_result.get("result", None)
-            
-            # Parse JSON output
-            if isinstance(notebook_output, str):
-                try:
-                    notebook_output = json.loads(notebook_output)
-                except:
-                    pass
-    
-    return result_state, notebook_output
+# Anomaly score percentiles reported by the notebook, and where a score can fall among them
+PERCENTILE_KEYS = ('25th', '50th', '75th', '90th', '99th')
+PERCENTILE_POSITIONS = (
+    "below the 25th percentile",
+    "between the 25th and 50th percentiles",
+    "between the 50th and 75th percentiles",
+    "between the 75th and 90th percentiles",
+    "between the 90th and 99th percentiles",
+    "above the 99th percentile",
+)
 
 # Streamlit UI
+prewarm_cluster()
 st.title("📞 Telecom Fraud Detection")
 
 # Cache the default layouts for faster rendering
@@ -127,8 +48,212 @@ def get_plotly_layout(title):
         "margin": {"l": 40, "r": 40, "t": 50, "b": 40}
     }
 
-# Main phone number input
-phone_number = st.text_input("Enter Phone Number to Check")
+# Thin out large scatter traces so the browser isn't sent every point
+def downsample_points(x, y, max_points=MAX_SCATTER_POINTS):
+    x = np.asarray(x, dtype=np.float32)
+    y = np.asarray(y, dtype=np.float32)
+    if len(x) <= max_points:
+        return x, y
+    # Evenly spaced indices keep the spread of the data and are deterministic across reruns
+    idx = np.linspace(0, len(x) - 1, max_points).astype(np.intp)
+    return x[idx], y[idx]
+
+# Cache the individual feature importance figure per result
+@st.cache_data(max_entries=64, show_spinner=False)
+def build_importance_figure(importance):
+    # Pick the top features with NumPy and plot the arrays directly
+    names = np.array(list(importance))
+    values = np.fromiter(importance.values(), dtype=np.float32, count=len(names))
+    if len(values) > MAX_IMPORTANCE_BARS:
+        # Partition first so only the shown features are sorted
+        top = np.argpartition(-values, MAX_IMPORTANCE_BARS - 1)[:MAX_IMPORTANCE_BARS]
+        order = top[np.argsort(-values[top])]
+    else:
+        order = np.argsort(-values)
+    
+    # Create bar chart directly with graph_objects - no plotly.express inference pass
+    fig_importance = go.Figure(go.Bar(
+        x=values[order],
+        y=names[order],
+        orientation='h',
+        marker=dict(
+            color=values[order],
+            colorscale='Blues',
+            showscale=True,
+            colorbar=dict(title='Importance')
+        )
+    ))
+    fig_importance.update_layout(get_plotly_layout("Feature Importance"))
+    fig_importance.update_layout(xaxis_title='Importance', yaxis_title='Feature')
+    return fig_importance
+
+# Cache the SHAP waterfall figure per result so reruns skip rebuilding it
+@st.cache_data(max_entries=64, show_spinner=False)
+def build_waterfall_figure(waterfall_data, base_value):
+    # Read SHAP values straight into a float array instead of an intermediate list
+    features = list(waterfall_data)
+    shap_values = np.fromiter(
+        (contribution['shap_value'] for contribution in waterfall_data.values()),
+        dtype=np.float32,
+        count=len(features)
+    )
+    
+    # Create waterfall chart with Plotly
+    fig_waterfall = go.Figure(go.Waterfall(
+        name="SHAP Values", 
+        orientation="h",
+        y=features,
+        x=shap_values,
+        connector={"line":{"color":"rgb(63, 63, 63)"}},
+        decreasing={"marker":{"color":"#FF4B4B"}},
+        increasing={"marker":{"color":"#007BFF"}},
+        base=base_value
+    ))
+    fig_waterfall.update_layout(get_plotly_layout("SHAP Waterfall Plot"))
+    return fig_waterfall
+
+# Cache the combined feature importance figure per result
+@st.cache_data(max_entries=64, show_spinner=False)
+def build_combined_importance_figure(feature_importance):
+    # Convert feature importance data to DataFrame for plotting
+    fi_df = pd.DataFrame(feature_importance).sort_values('importance', ascending=False)
+    
+    fig_importance = px.bar(
+        fi_df, 
+        x='importance', 
+        y='feature', 
+        orientation='h',
+        title='Feature Importance',
+        color='importance',
+        color_continuous_scale='Blues'
+    )
+    fig_importance.update_layout(get_plotly_layout("Combined Feature Importance"))
+    return fig_importance
+
+# Short digest of a check's output - computed once per check so the large figure
+# caches below can key on it instead of hashing the whole payload on every rerun
+def result_digest(notebook_output):
+    raw = json.dumps(notebook_output, sort_keys=True, default=str)
+    return hashlib.blake2b(raw.encode(), digest_size=16).hexdigest()
+
+# Cache the SHAP vs. feature value scatter per result (underscored payload is not hashed)
+@st.cache_data(max_entries=64, show_spinner=False)
+def build_feature_impact_figure(result_key, _feature_impact, top_features):
+    # Create a figure for SHAP summary plot using Plotly
+    fig = go.Figure()
+    
+    # For each top feature, create a scatter plot
+    for feature in top_features:
+        if feature in _feature_impact:
+            feature_data = _feature_impact[feature]
+            feature_values, feature_shap = downsample_points(
+                feature_data['feature_values'],
+                feature_data['shap_values']
+            )
+            
+            fig.add_trace(go.Scattergl(
+                x=feature_values,
+                y=feature_shap,
+                mode='markers',
+                name=feature,
+                marker=dict(
+                    size=8,
+                    opacity=0.7,
+                    line=dict(width=1)
+                )
+            ))
+    
+    fig.update_layout(get_plotly_layout("SHAP Values vs. Feature Values"))
+    return fig
+
+# Cache the anomaly score histogram per result (underscored payload is not hashed)
+@st.cache_data(max_entries=64, show_spinner=False)
+def build_distribution_figure(result_key, _dist_data):
+    # Create histogram using plotly
+    fig = go.Figure()
+
+    # Add histogram bars
+    edges = np.asarray(_dist_data['bin_edges'], dtype=np.float32)
+    bin_centers = (edges[:-1] + edges[1:]) * 0.5
+    fig.add_trace(go.Bar(
+        x=bin_centers,
+        y=np.asarray(_dist_data['histogram_values'], dtype=np.float32),
+        name='Anomaly Scores'
+    ))
+
+    # Add threshold line
+    fig.add_shape(
+        type="line",
+        x0=_dist_data['threshold'], 
+        y0=0,
+        x1=_dist_data['threshold'], 
+        y1=max(_dist_data['histogram_values']),
+        line=dict(color="red", width=2, dash="dash")
+    )
+
+    # Add current phone number line if available
+    if _dist_data['current_phone_score'] is not None:
+        fig.add_shape(
+            type="line",
+            x0=_dist_data['current_phone_score'], 
+            y0=0,
+            x1=_dist_data['current_phone_score'], 
+            y1=max(_dist_data['histogram_values']),
+            line=dict(color="green", width=2)
+        )
+
+        # Add annotation for current phone
+        fig.add_annotation(
+            x=_dist_data['current_phone_score'],
+            y=max(_dist_data['histogram_values'])/2,
+            text=f"Current: {_dist_data['current_phone_number']}",
+            showarrow=True,
+            arrowhead=1
+        )
+
+    fig.update_layout(get_plotly_layout("Distribution of Anomaly Scores"))
+    return fig
+
+# Cache the correlation heatmap per result (underscored payload is not hashed)
+@st.cache_data(max_entries=64, show_spinner=False)
+def build_correlation_figure(result_key, _correlation_matrix):
+    # Read the nested {column: {row: value}} dictionary straight into a float32 array
+    features = list(_correlation_matrix)
+    z = np.array(
+        [[_correlation_matrix[col][row] for col in features] for row in features],
+        dtype=np.float32
+    )
+    
+    # Create heatmap using plotly
+    fig = go.Figure(go.Heatmap(
+        z=z,
+        x=features,
+        y=features,
+        colorscale='RdBu_r',  # Blue (positive) to Red (negative)
+        zmin=-1, zmax=1,  # Correlation range
+    ))
+    
+    fig.update_layout(
+        height=600,
+        xaxis=dict(side="bottom"),
+        yaxis=dict(autorange="reversed"),
+        title="Feature Correlation Matrix"
+    )
+    return fig
+
+# Cache the percentile table on the five scores so the cache key is plain values
+@st.cache_data(max_entries=64, show_spinner=False)
+def build_percentiles_table(p25, p50, p75, p90, p99):
+    return pd.DataFrame({
+        'Percentile': ['25th', '50th (Median)', '75th', '90th', '99th'],
+        'Score': [p25, p50, p75, p90, p99]
+    })
+
+# Main phone number input - batched in a form so only submit triggers a rerun
+with st.form("fraud_check_form"):
+    phone_number = st.text_input("Enter Phone Number to Check")
+    force_refresh = st.checkbox("Force refresh", help="Ignore cached results and re-run the Databricks job")
+    submitted = st.form_submit_button("Run Fraud Check")
 
 # Information about the system
 with st.expander("ℹ️ About this system"):
@@ -142,300 +267,196 @@ with st.expander("ℹ️ About this system"):
     The system now returns all visualization data directly in JSON format for dynamic rendering in the UI.
     """)
 
-# Run detection when button clicked
-if st.button("Run Fraud Check", key="run_check_button"):
-    if phone_number.strip():
+# Run detection when the form is submitted
+if submitted:
+    if PHONE_PATTERN.fullmatch(phone_number.strip()):
+        if force_refresh:
+            clear_results(phone_number.strip())
         with st.spinner("Subex Spam Scoring started in Databricks..."):
-            result, notebook_output = run_notebook(phone_number.strip())
+            try:
+                result, notebook_output = run_notebook(phone_number.strip(), _force_refresh=force_refresh)
+            except RunFailed as e:
+                result, notebook_output = e.result, e.notebook_output
+        
+        # Keep the last check so widget reruns can redraw it without re-running the job
+        st.session_state["last_check"] = (
+            phone_number.strip(), result, notebook_output, result_digest(notebook_output)
+        )
+    else:
+        st.warning("📱 Please enter a valid phone number.")
+        st.session_state.pop("last_check", None)
+
+# Results panel as a fragment - widget changes inside it rerun only this function
+@st.fragment
+def render_results(checked_phone, result, notebook_output, output_digest):
+    result_key = (checked_phone, output_digest)
+    if result == "SUCCESS" and isinstance(notebook_output, dict) and notebook_output:
+        st.success("🎉 Analysis complete!")
+        
+        # Display prediction summary
+        st.subheader("📞 Prediction Summary")
+        col1, col2 = st.columns(2)
+        
+        with col1:
+            st.markdown(f"**Phone Number**: `{checked_phone}`")
+            st.markdown(f"**Prediction**: `{notebook_output['prediction']}`")
+        
+        with col2:
+            st.markdown(f"**Anomaly Score**: `{notebook_output['anomaly_score']:.4f}`")
+            st.markdown(f"**Processing Time**: `{notebook_output.get('time_taken_seconds', '?'):.2f}s`")
+        
+        # Display the explanation if available
+        if 'explanation' in notebook_output and notebook_output['explanation']:
+            st.markdown(f"**AI Explanation**: {notebook_output['explanation']}")
+        
+        # Create main tabs for Individual vs Combined Analysis
+        main_tabs = st.tabs(["📱 Individual Analysis", "🌐 Combined Dataset Analysis"])
+        
+        with main_tabs[0]:
+            # Sub-tabs for individual phone analysis
+            indiv_tabs = st.tabs(["Feature Importance", "SHAP Waterfall"])
             
-            if result == "SUCCESS" and notebook_output:
-                st.success("🎉 Analysis complete!")
-                
-                # Display prediction summary
-                st.subheader("📞 Prediction Summary")
-                col1, col2 = st.columns(2)
-                
+            with indiv_tabs[0]:
+                # Build (or reuse the cached) feature importance chart
+                fig_importance = build_importance_figure(notebook_output['feature_importance'])
+                st.plotly_chart(fig_importance, use_container_width=True, theme=None, key=f"importance_{checked_phone}")
+            
+            with indiv_tabs[1]:
+                # Build (or reuse the cached) waterfall chart
+                fig_waterfall = build_waterfall_figure(
+                    notebook_output['feature_contributions'],
+                    notebook_output['base_value']
+                )
+                st.plotly_chart(fig_waterfall, use_container_width=True, theme=None, key=f"waterfall_{checked_phone}")
+        
+        # Display Combined Analysis section with data from JSON
+        if 'combined_analysis' in notebook_output and notebook_output['combined_analysis']['status'] == 'success':
+            combined_data = notebook_output['combined_analysis']
+            # Define viz_data from the visualizations in combined_data
+            viz_data = combined_data.get('visualizations', {})
+            
+            with main_tabs[1]:
+                # Create metrics row with error handling for missing keys
+                col1, col2, col3 = st.columns(3)
                 with col1:
-                    st.markdown(f"**Phone Number**: `{phone_number}`")
-                    st.markdown(f"**Prediction**: `{notebook_output['prediction']}`")
-                
+                    st.metric("Total Records", combined_data.get('total_records', 'N/A'))
                 with col2:
-                    st.markdown(f"**Anomaly Score**: `{notebook_output['anomaly_score']:.4f}`")
-                    st.markdown(f"**Processing Time**: `{notebook_output.get('time_taken_seconds', '?'):.2f}s`")
-                
-                # Display the explanation if available
-                if 'explanation' in notebook_output and notebook_output['explanation']:
-                    st.markdown(f"**AI Explanation**: {notebook_output['explanation']}")
+                    anomaly_count = combined_data.get('anomaly_count', 'N/A')
+                    anomaly_percentage = combined_data.get('anomaly_percentage', 0)
+                    
+                    if anomaly_count != 'N/A' and isinstance(anomaly_percentage, (int, float)):
+                        metric_value = f"{anomaly_count} ({anomaly_percentage:.1f}%)"
+                    else:
+                        metric_value = 'N/A'
+                        
+                    st.metric("Anomalies", metric_value)
+                with col3:
+                    st.metric("Normal Records", combined_data.get('normal_count', 'N/A'))
                 
-                # Create main tabs for Individual vs Combined Analysis
-                main_tabs = st.tabs(["📱 Individual Analysis", "🌐 Combined Dataset Analysis"])
+                # Pick one visualization at a time so only the visible chart is built
+                combined_view = st.radio(
+                    "View",
+                    ["Feature Importance", "Feature Impact", "Anomaly Distribution", "Correlation Heatmap"],
+                    horizontal=True,
+                    key="combined_view"
+                )
                 
-                with main_tabs[0]:
-                    # Sub-tabs for individual phone analysis
-                    indiv_tabs = st.tabs(["Feature Importance", "SHAP Waterfall"])
+                # This section contains the combined dataset analysis
+                if combined_view == "Feature Importance":
+                    st.subheader("Combined Feature Importance")
+                    st.markdown("This chart shows the most important features across all records in the dataset.")
                     
-                    with indiv_tabs[0]:
-                        # Convert feature importance to DataFrame for plotting
-                        feature_importance_df = pd.DataFrame({
-                            'Feature': list(notebook_output['feature_importance'].keys()),
-                            'Importance': list(notebook_output['feature_importance'].values())
-                        }).sort_values('Importance', ascending=False)
+                    # Create feature importance plot using Plotly from JSON data
+                    if 'feature_importance' in viz_data:
+                        fig_importance = build_combined_importance_figure(viz_data['feature_importance'])
+                        st.plotly_chart(fig_importance, use_container_width=True, theme=None, key=f"combined_importance_{checked_phone}")
                         
-                        # Create bar chart with Plotly
-                        fig_importance = px.bar(
-                            feature_importance_df, 
-                            x='Importance', 
-                            y='Feature', 
-                            orientation='h',
-                            color='Importance',
-                            color_continuous_scale='Blues'
-                        )
-                        fig_importance.update_layout(get_plotly_layout("Feature Importance"))
-                        st.plotly_chart(fig_importance, use_container_width=True)
+                        # Show top features list
+                        st.markdown("**Top 5 Most Important Features**")
+                        for i, feature in enumerate(combined_data['top_features']):
+                            st.markdown(f"{i+1}. **{feature}**")
+                    else:
+                        st.warning("Feature importance data not found in the response.")
+                
+                elif combined_view == "Feature Impact":
+                    st.subheader("Feature Value Impact")
+                    st.markdown("This chart shows how different feature values impact the model's decision across the dataset.")
                     
-                    with indiv_tabs[1]:
-                        # Extract waterfall data
-                        waterfall_data = notebook_output['feature_contributions']
-                        features = list(waterfall_data.keys())
-                        shap_values = [waterfall_data[f]['shap_value'] for f in features]
-                        
-                        # Create waterfall chart with Plotly
-                        fig_waterfall = go.Figure(go.Waterfall(
-                            name="SHAP Values", 
-                            orientation="h",
-                            y=features,
-                            x=shap_values,
-                            connector={"line":{"color":"rgb(63, 63, 63)"}},
-                            decreasing={"marker":{"color":"#FF4B4B"}},
-                            increasing={"marker":{"color":"#007BFF"}},
-                            base=notebook_output['base_value']
-                        ))
-                        fig_waterfall.update_layout(get_plotly_layout("SHAP Waterfall Plot"))
-                        st.plotly_chart(fig_waterfall, use_container_width=True)
+                    # Create feature impact visualization from JSON data
+                    if 'feature_impact' in viz_data:
+                        # Select top features based on importance for clarity
+                        top_features = combined_data['top_features'][:5]  # Top 5 features
+                        fig = build_feature_impact_figure(result_key, viz_data['feature_impact'], top_features)
+                        st.plotly_chart(fig, use_container_width=True, theme=None, key=f"feature_impact_{checked_phone}")
+                    else:
+                        st.warning("Feature impact data not found in the response.")
                 
-                # Display Combined Analysis section with data from JSON
-                if 'combined_analysis' in notebook_output and notebook_output['combined_analysis']['status'] == 'success':
-                    combined_data = notebook_output['combined_analysis']
-                    # Define viz_data from the visualizations in combined_data
-                    viz_data = combined_data.get('visualizations', {})
+                elif combined_view == "Anomaly Distribution":
+                    st.subheader("Anomaly Score Distribution")
+                    st.markdown("Distribution of anomaly scores across all records, with current number highlighted.")
                     
-                    with main_tabs[1]:
-                        # Create metrics row with error handling for missing keys
-                        col1, col2, col3 = st.columns(3)
-                        with col1:
-                            st.metric("Total Records", combined_data.get('total_records', 'N/A'))
-                        with col2:
-                            anomaly_count = combined_data.get('anomaly_count', 'N/A')
-                            anomaly_percentage = combined_data.get('anomaly_percentage', 0)
-                            
-                            if anomaly_count != 'N/A' and isinstance(anomaly_percentage, (int, float)):
-                                metric_value = f"{anomaly_count} ({anomaly_percentage:.1f}%)"
-                            else:
-                                metric_value = 'N/A'
-                                
-                            st.metric("Anomalies", metric_value)
-                        with col3:
-                            st.metric("Normal Records", combined_data.get('normal_count', 'N/A'))
-                        
-                        # Create tabs for different visualizations from JSON data
-                        combined_tabs = st.tabs(["Feature Importance", "Feature Impact", "Anomaly Distribution", "Correlation Heatmap"])
+                    # Create anomaly distribution histogram from JSON data
+                    if 'anomaly_distribution' in viz_data:
+                        dist_data = viz_data['anomaly_distribution']
                         
-                        # This section contains the combined dataset analysis
-                        with combined_tabs[0]:
-                            st.subheader("Combined Feature Importance")
-                            st.markdown("This chart shows the most important features across all records in the dataset.")
-                            
-                            # Create feature importance plot using Plotly from JSON data
-                            if 'feature_importance' in viz_data:
-                                # Convert feature importance data to DataFrame for plotting
-                                fi_df = pd.DataFrame(viz_data['feature_importance']).sort_values('importance', ascending=False)
-                                
-                                fig_importance = px.bar(
-                                    fi_df, 
-                                    x='importance', 
-                                    y='feature', 
-                                    orientation='h',
-                                    title='Feature Importance',
-                                    color='importance',
-                                    color_continuous_scale='Blues'
-                                )
-                                fig_importance.update_layout(get_plotly_layout("Combined Feature Importance"))
-                                st.plotly_chart(fig_importance, use_container_width=True)
-                                
-                                # Show top features list
-                                st.markdown("**Top 5 Most Important Features**")
-                                for i, feature in enumerate(combined_data['top_features']):
-                                    st.markdown(f"{i+1}. **{feature}**")
-                            else:
-                                st.warning("Feature importance data not found in the response.")
+                        fig = build_distribution_figure(result_key, dist_data)
+                        st.plotly_chart(fig, use_container_width=True, theme=None, key=f"anomaly_distribution_{checked_phone}")
                         
-                        with combined_tabs[1]:
-                            st.subheader("Feature Value Impact")
-                            st.markdown("This chart shows how different feature values impact the model's decision across the dataset.")
+                        # Display percentile information with error handling
+                        if 'anomaly_metrics' in combined_data and 'anomaly_score_percentiles' in combined_data.get('anomaly_metrics', {}):
+                            metrics = combined_data['anomaly_metrics']
+                            percentiles = metrics.get('anomaly_score_percentiles', {})
                             
-                            # Create feature impact visualization from JSON data
-                            if 'feature_impact' in viz_data:
-                                # Select top features based on importance for clarity
-                                top_features = combined_data['top_features'][:5]  # Top 5 features
-                                
-                                # Create a figure for SHAP summary plot using Plotly
-                                fig = go.Figure()
-                                
-                                # For each top feature, create a scatter plot
-                                for feature in top_features:
-                                    if feature in viz_data['feature_impact']:
-                                        feature_data = viz_data['feature_impact'][feature]
-                                        
-                                        fig.add_trace(go.Scatter(
-                                            x=feature_data['feature_values'],
-                                            y=feature_data['shap_values'],
-                                            mode='markers',
-                                            name=feature,
-                                            marker=dict(
-                                                size=8,
-                                                opacity=0.7,
-                                                line=dict(width=1)
-                                            )
-                                        ))
-                                
-                                fig.update_layout(get_plotly_layout("SHAP Values vs. Feature Values"))
-                                st.plotly_chart(fig, use_container_width=True)
-                            else:
-                                st.warning("Feature impact data not found in the response.")
-                        
-                        with combined_tabs[2]:
-                            st.subheader("Anomaly Score Distribution")
-                            st.markdown("Distribution of anomaly scores across all records, with current number highlighted.")
+                            st.subheader("Anomaly Score Percentiles")
+                            percentiles_df = build_percentiles_table(
+                                *(percentiles.get(k, 'N/A') for k in PERCENTILE_KEYS)
+                            )
+                            st.table(percentiles_df)
                             
-                            # Create anomaly distribution histogram from JSON data
-                            if 'anomaly_distribution' in viz_data:
-                                dist_data = viz_data['anomaly_distribution']
-                                
-                                # Create histogram using plotly
-                                fig = go.Figure()
-                                
-                                # Add histogram bars
-                                bin_centers = [(dist_data['bin_edges'][i] + dist_data['bin_edges'][i+1])/2 for i in range(len(dist_data['bin_edges'])-1)]
-                                fig.add_trace(go.Bar(
-                                    x=bin_centers,
-                                    y=dist_data['histogram_values'],
-                                    name='Anomaly Scores'
-                                ))
-                                
-                                # Add threshold line
-                                fig.add_shape(
-                                    type="line",
-                                    x0=dist_data['threshold'], 
-                                    y0=0,
-                                    x1=dist_data['threshold'], 
-                                    y1=max(dist_data['histogram_values']),
-                                    line=dict(color="red", width=2, dash="dash")
-                                )
-                                
-                                # Add current phone number line if available
-                                if dist_data['current_phone_score'] is not None:
-                                    fig.add_shape(
-                                        type="line",
-                                        x0=dist_data['current_phone_score'], 
-                                        y0=0,
-                                        x1=dist_data['current_phone_score'], 
-                                        y1=max(dist_data['histogram_values']),
-                                        line=dict(color="green", width=2)
-                                    )
-                                    
-                                    # Add annotation for current phone
-                                    fig.add_annotation(
-                                        x=dist_data['current_phone_score'],
-                                        y=max(dist_data['histogram_values'])/2,
-                                        text=f"Current: {dist_data['current_phone_number']}",
-                                        showarrow=True,
-                                        arrowhead=1
-                                    )
-                                
-                                fig.update_layout(get_plotly_layout("Distribution of Anomaly Scores"))
-                                st.plotly_chart(fig, use_container_width=True)
-                                
-                                # Display percentile information with error handling
-                                if 'anomaly_metrics' in combined_data and 'anomaly_score_percentiles' in combined_data.get('anomaly_metrics', {}):
-                                    metrics = combined_data['anomaly_metrics']
+                            # Show where this phone number's score falls in the distribution
+                            if 'anomaly_score' in notebook_output and 'anomaly_metrics' in combined_data and 'anomaly_score_percentiles' in combined_data.get('anomaly_metrics', {}):
+                                try:
+                                    current_score = notebook_output['anomaly_score']
                                     percentiles = metrics.get('anomaly_score_percentiles', {})
+                                    percentile_position = None
                                     
-                                    st.subheader("Anomaly Score Percentiles")
-                                    percentiles_df = pd.DataFrame({
-                                        'Percentile': ['25th', '50th (Median)', '75th', '90th', '99th'],
-                                        'Score': [
-                                            percentiles.get('25th', 'N/A'), 
-                                            percentiles.get('50th', 'N/A'),
-                                            percentiles.get('75th', 'N/A'),
-                                            percentiles.get('90th', 'N/A'),
-                                            percentiles.get('99th', 'N/A')
-                                        ]
-                                    })
-                                    st.table(percentiles_df)
-                                    
-                                    # Show where this phone number's score falls in the distribution
-                                    if 'anomaly_score' in notebook_output and 'anomaly_metrics' in combined_data and 'anomaly_score_percentiles' in combined_data.get('anomaly_metrics', {}):
-                                        try:
-                                            current_score = notebook_output['anomaly_score']
-                                            percentiles = metrics.get('anomaly_score_percentiles', {})
-                                            percentile_position = None
-                                            
-                                            if isinstance(current_score, (int, float)) and all(isinstance(p, (int, float)) for p in [
-                                                percentiles.get('25th'), percentiles.get('50th'), 
-                                                percentiles.get('75th'), percentiles.get('90th'), 
-                                                percentiles.get('99th')]):
-                                                
-                                                if current_score <= percentiles.get('25th'):
-                                                    percentile_position = "below the 25th percentile"
-                                                elif current_score <= percentiles.get('50th'):
-                                                    percentile_position = "between the 25th and 50th percentiles"
-                                                elif current_score <= percentiles.get('75th'):
-                                                    percentile_position = "between the 50th and 75th percentiles"
-                                                elif current_score <= percentiles.get('90th'):
-                                                    percentile_position = "between the 75th and 90th percentiles"
-                                                elif current_score <= percentiles.get('99th'):
-                                                    percentile_position = "between the 90th and 99th percentiles"
-                                                else:
-                                                    percentile_position = "above the 99th percentile"
-                                                
-                                                st.markdown(f"This phone number's anomaly score of **{current_score:.4f}** falls {percentile_position} of all scores.")
-                                        except (TypeError, ValueError) as e:
-                                            st.warning("Could not determine percentile position due to data type issues.")
-                            else:
-                                st.warning("Anomaly distribution data not found in the response.")
+                                    pct_values = [percentiles.get(k) for k in PERCENTILE_KEYS]
+                                    if isinstance(current_score, (int, float)) and all(isinstance(p, (int, float)) for p in pct_values):
+                                        
+                                        # Left-sided search matches the "score <= percentile" buckets
+                                        idx = int(np.searchsorted(np.asarray(pct_values, dtype=np.float64), current_score))
+                                        percentile_position = PERCENTILE_POSITIONS[idx]
+                                        
+                                        st.markdown(f"This phone number's anomaly score of **{current_score:.4f}** falls {percentile_position} of all scores.")
+                                except (TypeError, ValueError) as e:
+                                    st.warning("Could not determine percentile position due to data type issues.")
+                    else:
+                        st.warning("Anomaly distribution data not found in the response.")
+                
+                elif combined_view == "Correlation Heatmap":
+                    st.subheader("Feature Correlation Heatmap")
+                    st.markdown("This heatmap shows correlations between features in the dataset.")
+                    
+                    # Create correlation heatmap from JSON data
+                    if 'correlation_matrix' in viz_data:
+                        fig = build_correlation_figure(result_key, viz_data['correlation_matrix'])
                         
-                        with combined_tabs[3]:
-                            st.subheader("Feature Correlation Heatmap")
-                            st.markdown("This heatmap shows correlations between features in the dataset.")
-                            
-                            # Create correlation heatmap from JSON data
-                            if 'correlation_matrix' in viz_data:
-                                # Convert the nested dictionary to a DataFrame
-                                corr_data = pd.DataFrame(viz_data['correlation_matrix'])
-                                
-                                # Create heatmap using plotly
-                                fig = px.imshow(
-                                    corr_data,
-                                    color_continuous_scale='RdBu_r',  # Blue (positive) to Red (negative)
-                                    zmin=-1, zmax=1,  # Correlation range
-                                )
-                                
-                                fig.update_layout(
-                                    height=600,
-                                    xaxis=dict(side="bottom"),
-                                    title="Feature Correlation Matrix"
-                                )
-                                
-                                st.plotly_chart(fig, use_container_width=True)
-                                st.markdown("Strong positive correlations appear in dark blue, while strong negative correlations appear in dark red.")
-                            else:
-                                st.warning("Correlation matrix data not found in the response.")
-                else:
-                    st.warning("Visualization data not found in the response. The backend may be using an older version.")
-            
-            elif "error" in notebook_output:
-                st.error(f"❌ Error: {notebook_output['error']}")
-            else:
-                st.error(f"❌ Job failed: {result}")
+                        st.plotly_chart(fig, use_container_width=True, theme=None, key=f"correlation_{checked_phone}")
+                        st.markdown("Strong positive correlations appear in dark blue, while strong negative correlations appear in dark red.")
+                    else:
+                        st.warning("Correlation matrix data not found in the response.")
+        else:
+            st.warning("Visualization data not found in the response. The backend may be using an older version.")
+    
+    elif isinstance(notebook_output, dict) and "error" in notebook_output:
+        st.error(f"❌ Error: {notebook_output['error']}")
+    elif isinstance(notebook_output, str):
+        # Cap the raw payload so a large non-JSON result isn't copied into the page
+        st.error("❌ Job returned an unexpected output format.")
+        st.code(notebook_output[:4096])
     else:
-        st.warning("📱 Please enter a valid phone number.")
+        st.error(f"❌ Job failed: {result}")
+
+# Render the most recent check
+if "last_check" in st.session_state:
+    render_results(*st.session_state["last_check"])
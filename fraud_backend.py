@@ -0,0 +1,404 @@
+import streamlit as st
+import json
+import logging
+import os
+import hashlib
+import random
+import sqlite3
+import threading
+import time
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+# Prefer orjson for decoding Databricks responses when it is installed
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+# orjson rejects the NaN/Infinity that json.dumps writes by default, so fall back to the stdlib
+def json_loads(data):
+    if orjson is not None:
+        try:
+            return orjson.loads(data)
+        except orjson.JSONDecodeError:
+            pass
+    return json.loads(data)
+
+# Databricks life-cycle states after which a run will not change again
+TERMINAL_STATES = frozenset(("TERMINATED", "SKIPPED", "INTERNAL_ERROR"))
+
+# Seconds during which repeated submissions for a number reuse the same run
+IDEMPOTENCY_WINDOW = 60
+
+# How long finished results are reused, in memory and in the on-disk store
+RESULT_TTL = 24 * 60 * 60
+
+# SQLite file holding finished results across restarts. Rows contain phone numbers and
+# verdicts in plain text, so the file is private to the app user; in production point
+# FRAUD_RESULT_STORE at a persistent volume so results survive redeploys
+RESULT_STORE_PATH = os.getenv(
+    "FRAUD_RESULT_STORE",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), ".fraud_store", "results.sqlite3")
+)
+
+# (connect, read) timeout in seconds for Databricks REST calls
+REQUEST_TIMEOUT = (5, 30)
+
+logger = logging.getLogger(__name__)
+if os.getenv("FRAUD_DEBUG"):
+    logging.basicConfig()
+    logger.setLevel(logging.DEBUG)
+
+# Cache configuration values
+@st.cache_data
+def get_config():
+    return {
+        "DATABRICKS_HOST": st.secrets["databricks_host"],
+        "DATABRICKS_TOKEN": st.secrets["databricks_token"],
+        "DATABRICKS_NOTEBOOK_PATH": st.secrets["databricks_notebook_path"],
+        "EXISTING_CLUSTER_ID": "0521-131856-gsh3b6se",
+        "MODEL_VERSION": str(st.secrets.get("model_version", "1"))
+    }
+
+# Cache the Databricks REST endpoints built from the configured host
+@st.cache_data
+def get_api_urls():
+    host = get_config()["DATABRICKS_HOST"]
+    return {
+        "clusters_get": f"{host}/api/2.0/clusters/get",
+        "clusters_start": f"{host}/api/2.0/clusters/start",
+        "runs_submit": f"{host}/api/2.1/jobs/runs/submit",
+        "runs_get": f"{host}/api/2.1/jobs/runs/get",
+        "runs_get_output": f"{host}/api/2.1/jobs/runs/get-output"
+    }
+
+# Pooled HTTP session for the Databricks REST API - cached resource
+@st.cache_resource
+def get_http():
+    config = get_config()
+    session = requests.Session()
+    session.headers.update({
+        "Authorization": f"Bearer {config['DATABRICKS_TOKEN']}",
+        "Content-Type": "application/json"
+    })
+    # Retry transient errors and throttling; POST (runs/submit) is not retried by default
+    retries = Retry(
+        total=3,
+        backoff_factor=0.5,
+        status_forcelist=[429, 500, 502, 503, 504],
+        raise_on_status=False
+    )
+    adapter = HTTPAdapter(pool_connections=8, pool_maxsize=16, max_retries=retries)
+    session.mount("https://", adapter)
+    return session
+
+# Start the job cluster in the background while the user types - once per process
+@st.cache_resource
+def prewarm_cluster():
+    def _prewarm():
+        # Missing secrets or a bad host must not take the page down with them
+        try:
+            urls = get_api_urls()
+            session = get_http()
+            cluster_id = get_config()["EXISTING_CLUSTER_ID"]
+            response = session.get(
+                urls["clusters_get"],
+                params={"cluster_id": cluster_id},
+                timeout=REQUEST_TIMEOUT
+            )
+            state = response.json().get("state")
+            if state in ("TERMINATED", "TERMINATING"):
+                session.post(
+                    urls["clusters_start"],
+                    json={"cluster_id": cluster_id},
+                    timeout=REQUEST_TIMEOUT
+                )
+            logger.debug("Cluster %s prewarm state=%s", cluster_id, state)
+        except Exception as e:
+            logger.warning("Cluster prewarm failed: %s", e)
+
+    thread = threading.Thread(target=_prewarm, daemon=True)
+    thread.start()
+    return thread
+
+# Submit the fraud-check notebook as a one-off run and return its run_id
+def submit_notebook(phone_number, force_refresh=False):
+    config = get_config()
+
+    # Submit job with optimized parameters
+    submit_payload = {
+        "run_name": f"FraudCheck_{phone_number}",
+        "notebook_task": {
+            "notebook_path": config["DATABRICKS_NOTEBOOK_PATH"],
+            "base_parameters": {
+                "phone_number": phone_number
+            }
+        },
+        "existing_cluster_id": config["EXISTING_CLUSTER_ID"]
+    }
+
+    # Identical submissions within the same minute map to one Databricks run,
+    # unless the caller explicitly asked for a fresh one
+    if not force_refresh:
+        bucket = int(time.time() // IDEMPOTENCY_WINDOW)
+        attempt = get_failed_attempts().get(phone_number, 0)
+        submit_payload["idempotency_token"] = f"FraudCheck_{phone_number}_{bucket}_{attempt}"
+
+    try:
+        response = get_http().post(
+            get_api_urls()["runs_submit"],
+            json=submit_payload,
+            timeout=REQUEST_TIMEOUT
+        )
+    except requests.RequestException as e:
+        return None, {"error": str(e)}
+
+    if response.status_code != 200:
+        return None, {"error": response.text}
+
+    return response.json()["run_id"], None
+
+# Fetch the current state of a run with a single runs/get call - (payload, error),
+# with neither set when the read failed transiently and is worth retrying
+def get_run_state(run_id):
+    try:
+        status_response = get_http().get(
+            get_api_urls()["runs_get"],
+            params={"run_id": run_id},
+            timeout=REQUEST_TIMEOUT
+        )
+    except requests.RequestException as e:
+        logger.warning("runs/get for run %s failed: %s", run_id, e)
+        return None, None
+    status_code = status_response.status_code
+    if status_code != 200:
+        logger.warning("runs/get for run %s returned HTTP %s", run_id, status_code)
+        # The session has already retried 429/5xx (honouring Retry-After); let the poll loop back off
+        if status_code == 429 or status_code >= 500:
+            return None, None
+        # Anything else (dead run, bad token) will not get better by polling
+        return None, {"error": status_response.text}
+    payload = json_loads(status_response.content)
+    logger.debug("Run %s life_cycle_state=%s", run_id, payload["state"]["life_cycle_state"])
+    return payload, None
+
+# Fetch and parse the notebook output of a finished run - (output, error)
+def get_run_output(run_id):
+    try:
+        output_response = get_http().get(
+            get_api_urls()["runs_get_output"],
+            params={"run_id": run_id},
+            timeout=REQUEST_TIMEOUT
+        )
+    except requests.RequestException as e:
+        logger.warning("runs/get-output for run %s failed: %s", run_id, e)
+        return None, {"error": str(e)}
+
+    if output_response.status_code != 200:
+        logger.warning("runs/get-output for run %s returned HTTP %s", run_id, output_response.status_code)
+        return None, {"error": output_response.text}
+
+    notebook_result = json_loads(output_response.content).get("notebook_output", {})
+    notebook_output = notebook_result.get("result", None)
+    
+    # Parse JSON output only when it looks like a JSON object
+    if isinstance(notebook_output, str) and notebook_output.lstrip().startswith("{"):
+        try:
+            notebook_output = json_loads(notebook_output)
+        except ValueError:
+            pass
+
+    return notebook_output, None
+
+# Raised out of run_notebook so failed checks are never kept in the result cache
+class RunFailed(Exception):
+    def __init__(self, result, notebook_output):
+        super().__init__(result)
+        self.result = result
+        self.notebook_output = notebook_output
+
+# Runs still in flight, by phone number - shared so a repeated check resumes polling
+@st.cache_resource
+def get_active_runs():
+    return {}
+
+# Failed checks, by phone number - part of the idempotency token so a retry isn't
+# handed the failed run back by Databricks
+@st.cache_resource
+def get_failed_attempts():
+    return {}
+
+# Key stored results on everything that changes the notebook's answer
+def _result_key(phone_number):
+    config = get_config()
+    raw = "|".join((
+        phone_number,
+        config["DATABRICKS_NOTEBOOK_PATH"],
+        config["EXISTING_CLUSTER_ID"],
+        config["MODEL_VERSION"]
+    ))
+    return hashlib.blake2b(raw.encode(), digest_size=16).hexdigest()
+
+# Create the store owner-only, switch it to WAL and create its table - once per process
+@st.cache_resource
+def _init_result_store():
+    os.makedirs(os.path.dirname(RESULT_STORE_PATH) or ".", mode=0o700, exist_ok=True)
+    fd = os.open(RESULT_STORE_PATH, os.O_RDWR | os.O_CREAT, 0o600)
+    try:
+        # Refuse a file planted by another user; SQLite gives -wal/-shm the same mode
+        if os.fstat(fd).st_uid != os.getuid():
+            raise PermissionError(f"{RESULT_STORE_PATH} is not owned by the app user")
+        os.fchmod(fd, 0o600)
+    finally:
+        os.close(fd)
+
+    conn = sqlite3.connect(RESULT_STORE_PATH, timeout=5)
+    try:
+        conn.execute("PRAGMA journal_mode=WAL")
+        with conn:
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS results "
+                "(key TEXT PRIMARY KEY, value TEXT NOT NULL, created REAL NOT NULL)"
+            )
+    finally:
+        conn.close()
+    return RESULT_STORE_PATH
+
+def _open_result_store():
+    return sqlite3.connect(_init_result_store(), timeout=5)
+
+# Look up a finished result in the on-disk store - best effort, misses on any error
+def load_stored_result(phone_number):
+    try:
+        conn = _open_result_store()
+        try:
+            row = conn.execute(
+                "SELECT value FROM results WHERE key = ? AND created > ?",
+                (_result_key(phone_number), time.time() - RESULT_TTL)
+            ).fetchone()
+        finally:
+            conn.close()
+    except (sqlite3.Error, OSError) as e:
+        logger.warning("Result store read failed: %s", e)
+        return None
+    if row is None:
+        return None
+    try:
+        return json_loads(row[0])
+    except ValueError as e:
+        logger.warning("Result store row could not be decoded: %s", e)
+        return None
+
+# Save a successful result to the on-disk store, dropping expired rows on the way
+def store_result(phone_number, notebook_output):
+    now = time.time()
+    try:
+        conn = _open_result_store()
+        try:
+            with conn:
+                conn.execute("DELETE FROM results WHERE created <= ?", (now - RESULT_TTL,))
+                conn.execute(
+                    "INSERT OR REPLACE INTO results (key, value, created) VALUES (?, ?, ?)",
+                    (_result_key(phone_number), json.dumps(notebook_output), now)
+                )
+        finally:
+            conn.close()
+    except (sqlite3.Error, OSError) as e:
+        logger.warning("Result store write failed: %s", e)
+
+# Drop the cached result for one number, in memory and on disk
+def clear_results(phone_number):
+    run_notebook.clear(phone_number)
+    try:
+        conn = _open_result_store()
+        try:
+            with conn:
+                conn.execute("DELETE FROM results WHERE key = ?", (_result_key(phone_number),))
+        finally:
+            conn.close()
+    except (sqlite3.Error, OSError) as e:
+        logger.warning("Result store clear failed: %s", e)
+
+# Optimized function to run notebook with caching for repeated checks
+@st.cache_data(ttl=RESULT_TTL, max_entries=1024, show_spinner=False)  # Cache results for a day
+def run_notebook(phone_number, _force_refresh=False):
+    # (the leading underscore keeps _force_refresh out of the cache key)
+    try:
+        return _check_number(phone_number, _force_refresh)
+    except RunFailed:
+        failed_attempts = get_failed_attempts()
+        failed_attempts[phone_number] = failed_attempts.get(phone_number, 0) + 1
+        raise
+
+# Fetch a stored result, or submit (or resume) the notebook run and poll it to completion
+def _check_number(phone_number, force_refresh):
+    # A result from before the last restart skips the Databricks job entirely
+    stored_output = load_stored_result(phone_number)
+    if stored_output is not None:
+        return "SUCCESS", stored_output
+    
+    # Resume an interrupted check of this number instead of submitting a new job
+    active_runs = get_active_runs()
+    run_id = None if force_refresh else active_runs.get(phone_number)
+    if run_id is None:
+        run_id, error = submit_notebook(phone_number, force_refresh=force_refresh)
+        if run_id is None:
+            raise RunFailed("FAILED", error)
+        active_runs[phone_number] = run_id
+    
+    # Status placeholder
+    status_placeholder = st.empty()
+    
+    # More efficient polling with increasing, jittered backoff
+    base_delay = 0.2
+    delay = base_delay
+    max_backoff = 30
+    max_wait = 600
+    started = time.monotonic()
+    while True:
+        payload, error = get_run_state(run_id)
+        if error is not None:
+            status_placeholder.empty()
+            active_runs.pop(phone_number, None)
+            raise RunFailed("FAILED", error)
+        run_state = payload["state"]["life_cycle_state"] if payload else None
+        
+        if run_state in TERMINAL_STATES:
+            break
+        
+        # Update the single placeholder in place instead of emitting new elements
+        if run_state:
+            status_placeholder.caption(f"⏳ Databricks run {run_id}: {run_state}")
+            
+        if time.monotonic() - started > max_wait:
+            status_placeholder.empty()
+            raise RunFailed("TIMEDOUT", {"error": f"Run {run_id} did not finish within {max_wait}s"})
+            
+        # Decorrelated jitter: each delay is drawn from [base_delay, 3x previous], so it grows
+        # about 1.5x per poll on average (a single draw can shrink it) and never lines up
+        # across sessions
+        delay = min(max_backoff, random.uniform(base_delay, delay * 3))
+        time.sleep(delay)
+    
+    status_placeholder.empty()
+    active_runs.pop(phone_number, None)
+
+    notebook_output_state = payload.get("state", {})
+    result_state = notebook_output_state.get("result_state", "UNKNOWN")
+    
+    if result_state != "SUCCESS":
+        raise RunFailed(result_state, None)
+
+    # Only a non-empty result object is worth caching; anything else is reported as a failure
+    notebook_output, error = get_run_output(run_id)
+    if error is not None:
+        raise RunFailed("FAILED", error)
+    if notebook_output is None or notebook_output == {}:
+        raise RunFailed("NO_OUTPUT", {"error": f"Run {run_id} succeeded but returned no output"})
+    if not isinstance(notebook_output, dict):
+        raise RunFailed(result_state, notebook_output)
+    store_result(phone_number, notebook_output)
+    
+    return result_state, notebook_output